@@ -1,6 +1,6 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, Response
 from database.models import db, Student, Teacher, Class, Enrollment, AttendanceSession, Attendance, ExamController
-from utils.face_recognition_utils import FaceRecognitionSystem, AttendanceTracker, process_uploaded_image
+from utils.face_recognition_utils import FaceRecognitionSystem, AttendanceTracker, process_uploaded_image, MAX_TEMPLATES_PER_STUDENT
 import cv2
 import os
 from datetime import datetime, date
@@ -14,13 +14,16 @@ app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attendance_system.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+# Minimum confidence for storing live captures as extra face templates (None disables).
+# Must be below 0.8: closer matches are near-duplicates of an existing template
+app.config['FACE_HARVEST_THRESHOLD'] = None
 
 # Initialize database
 db.init_app(app)
 
 # Global variables for camera and attendance tracking
 camera = None
-attendance_tracker = AttendanceTracker()
+attendance_tracker = AttendanceTracker(harvest_threshold=app.config['FACE_HARVEST_THRESHOLD'])
 current_session_id = None
 
 # Ensure upload directory exists
@@ -128,28 +131,37 @@ def student_register_face(student_id):
             flash('No photo uploaded', 'error')
             return redirect(request.url)
         
-        file = request.files['photo']
-        if file.filename == '':
+        files = [file for file in request.files.getlist('photo') if file.filename != '']
+        if not files:
             flash('No photo selected', 'error')
             return redirect(request.url)
         
-        if file:
+        if len(files) > MAX_TEMPLATES_PER_STUDENT:
+            flash(f'Please upload at most {MAX_TEMPLATES_PER_STUDENT} photos', 'error')
+            return redirect(request.url)
+        
+        file_paths = []
+        for file in files:
             filename = secure_filename(f"student_{student_id}_{file.filename}")
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(file_path)
             
-            # Process image and register face
+            # Validate each image before registration
             valid, message = process_uploaded_image(file_path)
             if valid:
-                face_system = FaceRecognitionSystem()
-                success, result_message = face_system.register_face(file_path, student_id)
-                if success:
-                    flash('Face registered successfully', 'success')
-                    return redirect(url_for('student_dashboard'))
-                else:
-                    flash(result_message, 'error')
+                file_paths.append(file_path)
             else:
-                flash(message, 'error')
+                flash(f"{file.filename}: {message}", 'error')
+        
+        if file_paths:
+            # Register with the live system so new templates are used immediately
+            face_system = attendance_tracker.face_recognition_system
+            success, result_message = face_system.register_face(file_paths, student_id)
+            if success:
+                flash(result_message, 'success')
+                return redirect(url_for('student_dashboard'))
+            else:
+                flash(result_message, 'error')
     
     return render_template('student/register_face.html', student=student)
 
@@ -305,8 +317,8 @@ def generate_frames():
         if not success:
             break
         
-        # Recognize faces in frame
-        recognized_students = attendance_tracker.face_recognition_system.recognize_faces_in_frame(frame)
+        # Recognize faces in frame; only the video loop harvests new templates
+        recognized_students = attendance_tracker.face_recognition_system.recognize_faces_in_frame(frame, harvest=True)
         
         # Mark attendance if session is active
         if current_session_id and recognized_students:
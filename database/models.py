@@ -11,7 +11,7 @@ class Student(db.Model):
     student_id = db.Column(db.String(20), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    face_encoding = db.Column(db.Text, nullable=True)  # JSON string of face encoding
+    face_encoding = db.Column(db.Text, nullable=True)  # JSON list of face templates
     photo_path = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -19,16 +19,41 @@ class Student(db.Model):
     attendances = db.relationship('Attendance', backref='student', lazy=True)
     
     def set_face_encoding(self, encoding):
-        """Convert numpy array to JSON string for storage"""
+        """Replace all stored templates with a single face encoding"""
         if encoding is not None:
-            self.face_encoding = json.dumps(encoding.tolist())
+            self.set_face_templates([(encoding, 1.0)])
     
     def get_face_encoding(self):
-        """Convert JSON string back to numpy array"""
-        if self.face_encoding:
-            import numpy as np
-            return np.array(json.loads(self.face_encoding))
+        """Return the highest quality face encoding, or None"""
+        templates = self.get_face_templates()
+        if templates:
+            return max(templates, key=lambda template: template[1])[0]
         return None
+    
+    def set_face_templates(self, templates):
+        """Store a list of (encoding, quality) pairs as a JSON string"""
+        if templates:
+            self.face_encoding = json.dumps([
+                {'encoding': encoding.tolist(), 'quality': float(quality)}
+                for encoding, quality in templates
+            ])
+        else:
+            self.face_encoding = None
+    
+    def get_face_templates(self):
+        """Convert the stored JSON string back to (encoding, quality) pairs"""
+        if not self.face_encoding:
+            return []
+        import numpy as np
+        data = json.loads(self.face_encoding)
+        # Older records hold a single bare encoding
+        if data and not isinstance(data[0], dict):
+            return [(np.array(data), 1.0)]
+        return [(np.array(item['encoding']), item.get('quality', 1.0)) for item in data]
+    
+    def get_face_encodings(self):
+        """Return every stored face encoding for this student"""
+        return [encoding for encoding, _ in self.get_face_templates()]
 
 class Teacher(db.Model):
     __tablename__ = 'teachers'
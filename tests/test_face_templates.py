@@ -0,0 +1,308 @@
+import json
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+# Stub the native vision libraries; only face_distance is needed here
+sys.modules.setdefault('cv2', mock.MagicMock())
+sys.modules.setdefault('face_recognition', mock.MagicMock())
+
+from database.models import Student
+from utils import face_recognition_utils
+from utils.face_recognition_utils import (
+    FaceRecognitionSystem, MAX_TEMPLATES_PER_STUDENT,
+    TEMPLATE_ADDED, TEMPLATE_REPLACED, TEMPLATE_DUPLICATE, TEMPLATE_REJECTED
+)
+
+
+def face_distance(face_encodings, face_to_compare):
+    """Same computation as face_recognition.face_distance"""
+    return np.linalg.norm(np.array(face_encodings) - face_to_compare, axis=1)
+
+
+def encoding(value):
+    """Build a 128-d encoding whose first component is value"""
+    vector = np.zeros(128)
+    vector[0] = value
+    return vector
+
+
+class FaceTemplateTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(face_recognition_utils.face_recognition, 'face_distance', face_distance)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with mock.patch.object(FaceRecognitionSystem, 'load_known_faces'):
+            self.system = FaceRecognitionSystem()
+        self.student = Student(id=1, name='Test Student')
+
+    def fill_gallery(self, qualities):
+        self.student.set_face_templates(
+            [(encoding(index), quality) for index, quality in enumerate(qualities)]
+        )
+
+    def stored_firsts(self):
+        return [template[0][0] for template in self.student.get_face_templates()]
+
+    def test_duplicate_keeps_better_template(self):
+        self.student.set_face_templates([(encoding(0.0), 0.5)])
+
+        result = self.system.add_face_template(self.student, encoding(0.1), 0.4)
+        self.assertEqual(result, TEMPLATE_DUPLICATE)
+        self.assertEqual(self.student.get_face_templates()[0][1], 0.5)
+
+        result = self.system.add_face_template(self.student, encoding(0.1), 0.9)
+        self.assertEqual(result, TEMPLATE_REPLACED)
+        templates = self.student.get_face_templates()
+        self.assertEqual(len(templates), 1)
+        self.assertEqual(templates[0][1], 0.9)
+        self.assertAlmostEqual(templates[0][0][0], 0.1)
+
+    def test_full_gallery_evicts_lowest_quality(self):
+        self.fill_gallery([0.9, 0.3, 0.8, 0.7, 0.6])
+
+        result = self.system.add_face_template(self.student, encoding(10.0), 0.5)
+        self.assertEqual(result, TEMPLATE_ADDED)
+        self.assertEqual(len(self.student.get_face_templates()), MAX_TEMPLATES_PER_STUDENT)
+        self.assertEqual(self.stored_firsts(), [0, 2, 3, 4, 10])
+
+    def test_capture_does_not_evict_on_tie(self):
+        self.fill_gallery([1.0] * MAX_TEMPLATES_PER_STUDENT)
+
+        result = self.system.add_face_template(self.student, encoding(10.0), 1.0)
+        self.assertEqual(result, TEMPLATE_REJECTED)
+        self.assertEqual(self.stored_firsts(), [0, 1, 2, 3, 4])
+
+    def test_upload_evicts_oldest_on_tie(self):
+        self.fill_gallery([1.0] * MAX_TEMPLATES_PER_STUDENT)
+
+        result = self.system.add_face_template(self.student, encoding(10.0), 1.0, upload=True)
+        self.assertEqual(result, TEMPLATE_ADDED)
+        self.assertEqual(self.stored_firsts(), [1, 2, 3, 4, 10])
+
+    def test_harvest_threshold_above_duplicate_band_rejected(self):
+        with mock.patch.object(FaceRecognitionSystem, 'load_known_faces'):
+            with self.assertRaises(ValueError):
+                FaceRecognitionSystem(harvest_threshold=0.9)
+            FaceRecognitionSystem(harvest_threshold=0.7)
+
+    def test_legacy_bare_encoding(self):
+        self.student.face_encoding = json.dumps(encoding(0.5).tolist())
+
+        templates = self.student.get_face_templates()
+        self.assertEqual(len(templates), 1)
+        self.assertEqual(templates[0][1], 1.0)
+        np.testing.assert_array_equal(self.student.get_face_encoding(), encoding(0.5))
+
+    def test_match_reduces_per_student(self):
+        students = []
+        for student_id, values in [(1, [0.0]), (2, [5.0, 6.0, 7.0]), (3, [2.0, 3.0])]:
+            student = Student(id=student_id, name=f'Student {student_id}')
+            student.set_face_templates([(encoding(value), 1.0) for value in values])
+            students.append(student)
+
+        with mock.patch.object(face_recognition_utils, 'Student') as student_model:
+            student_model.query.filter.return_value.all.return_value = students
+            self.system.load_known_faces()
+
+        _, offsets, student_ids, _ = self.system.known_faces
+        np.testing.assert_array_equal(offsets, [0, 1, 4])
+
+        faces = [encoding(6.9), encoding(3.1), encoding(0.2)]
+        indices, distances = self.system.match_face_encodings(faces)
+        self.assertEqual([student_ids[i] for i in indices], [2, 3, 1])
+        np.testing.assert_allclose(distances, [0.1, 0.1, 0.2])
+
+    def test_update_known_faces_matches_full_reload(self):
+        first = Student(id=1, name='First')
+        first.set_face_templates([(encoding(0.0), 1.0)])
+        second = Student(id=2, name='Second')
+        second.set_face_templates([(encoding(5.0), 1.0), (encoding(6.0), 1.0)])
+
+        self.system.update_known_faces(first)
+        self.system.update_known_faces(second)
+        first.set_face_templates([(encoding(0.0), 1.0), (encoding(1.0), 1.0), (encoding(2.0), 1.0)])
+        self.system.update_known_faces(first)
+
+        known_encodings, offsets, student_ids, names = self.system.known_faces
+        self.assertEqual(student_ids, (1, 2))
+        self.assertEqual(names, ('First', 'Second'))
+        np.testing.assert_array_equal(offsets, [0, 3])
+        np.testing.assert_array_equal(known_encodings[:, 0], [0, 1, 2, 5, 6])
+
+    def test_update_known_faces_publishes_new_snapshot(self):
+        self.student.set_face_templates([(encoding(0.0), 1.0)])
+        self.system.update_known_faces(self.student)
+        previous = self.system.known_faces
+
+        self.student.set_face_templates([(encoding(0.0), 1.0), (encoding(1.0), 1.0)])
+        self.system.update_known_faces(self.student)
+
+        self.assertIsNot(self.system.known_faces, previous)
+        self.assertEqual(len(previous[0]), 1)
+        self.assertEqual(previous[2], (1,))
+
+
+class HarvestTestCase(unittest.TestCase):
+    def setUp(self):
+        for name, value in [('face_distance', face_distance), ('face_locations', mock.DEFAULT),
+                            ('face_encodings', mock.DEFAULT), ('load_image_file', mock.DEFAULT)]:
+            patcher = mock.patch.object(face_recognition_utils.face_recognition, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.students = {}
+        student_patcher = mock.patch.object(face_recognition_utils, 'Student')
+        self.student_model = student_patcher.start()
+        self.addCleanup(student_patcher.stop)
+        self.student_model.query.get.side_effect = self.students.get
+
+        db_patcher = mock.patch.object(face_recognition_utils, 'db')
+        self.db = db_patcher.start()
+        self.addCleanup(db_patcher.stop)
+
+        with mock.patch.object(FaceRecognitionSystem, 'load_known_faces'):
+            self.system = FaceRecognitionSystem(harvest_threshold=0.7)
+
+    def add_student(self, student_id, values, quality=0.5):
+        student = Student(id=student_id, name=f'Student {student_id}')
+        student.set_face_templates([(encoding(value), quality) for value in values])
+        self.students[student_id] = student
+        self.system.update_known_faces(student)
+        return student
+
+    def test_harvest_stores_new_capture_and_refreshes_memory(self):
+        student = self.add_student(1, [0.0])
+
+        self.system.harvest_templates([(1, encoding(1.0), 0.8)])
+
+        self.assertEqual(len(student.get_face_templates()), 2)
+        self.db.session.commit.assert_called_once()
+        np.testing.assert_array_equal(self.system.known_faces[0][:, 0], [0.0, 1.0])
+
+    def test_harvest_skips_duplicates_without_commit(self):
+        student = self.add_student(1, [0.0], quality=1.0)
+        previous = self.system.known_faces
+
+        self.system.harvest_templates([(1, encoding(0.1), 0.5)])
+
+        self.assertEqual(len(student.get_face_templates()), 1)
+        self.db.session.commit.assert_not_called()
+        self.assertIs(self.system.known_faces, previous)
+
+    def test_harvest_skips_rejected_captures_without_commit(self):
+        student = self.add_student(1, range(MAX_TEMPLATES_PER_STUDENT), quality=1.0)
+
+        self.system.harvest_templates([(1, encoding(10.0), 0.9)])
+
+        self.assertEqual(len(student.get_face_templates()), MAX_TEMPLATES_PER_STUDENT)
+        self.db.session.commit.assert_not_called()
+
+    def test_harvest_only_refreshes_changed_students(self):
+        self.add_student(1, [0.0], quality=1.0)
+        changed = self.add_student(2, [5.0])
+
+        with mock.patch.object(self.system, 'update_known_faces') as update_known_faces:
+            self.system.harvest_templates([(1, encoding(0.1), 0.5), (2, encoding(6.0), 0.8)])
+
+        update_known_faces.assert_called_once_with(changed)
+        self.db.session.commit.assert_called_once()
+
+    def test_harvest_is_throttled_per_student(self):
+        student = self.add_student(1, [0.0])
+
+        with mock.patch.object(face_recognition_utils.time, 'time', return_value=1000.0):
+            self.system.harvest_templates([(1, encoding(1.0), 0.8)])
+            self.system.harvest_templates([(1, encoding(2.0), 0.8)])
+        self.assertEqual(len(student.get_face_templates()), 2)
+
+        later = 1000.0 + face_recognition_utils.HARVEST_INTERVAL
+        with mock.patch.object(face_recognition_utils.time, 'time', return_value=later):
+            self.system.harvest_templates([(1, encoding(2.0), 0.8)])
+        self.assertEqual(len(student.get_face_templates()), 3)
+
+    def recognize(self, faces, harvest):
+        face_recognition = face_recognition_utils.face_recognition
+        face_recognition.face_locations.return_value = [(0, 60, 60, 0)] * len(faces)
+        face_recognition.face_encodings.return_value = faces
+        with mock.patch.object(self.system, 'harvest_templates') as harvest_templates:
+            results = self.system.recognize_faces_in_frame(np.zeros((480, 640, 3)), harvest=harvest)
+        return results, harvest_templates
+
+    def test_recognize_harvests_only_above_threshold(self):
+        self.add_student(1, [0.0])
+        self.add_student(2, [5.0])
+
+        # Confidences 0.9 for student 1 and 0.5 for student 2
+        results, harvest_templates = self.recognize([encoding(0.1), encoding(5.5)], harvest=True)
+
+        self.assertEqual([result['student_id'] for result in results], [1, 2])
+        harvest_templates.assert_called_once()
+        candidates = harvest_templates.call_args[0][0]
+        self.assertEqual([candidate[0] for candidate in candidates], [1])
+        self.assertAlmostEqual(candidates[0][2], 60 / face_recognition_utils.REFERENCE_FACE_SIZE)
+
+    def test_recognize_does_not_harvest_by_default(self):
+        self.add_student(1, [0.0])
+
+        results, harvest_templates = self.recognize([encoding(0.1)], harvest=False)
+
+        self.assertEqual(len(results), 1)
+        harvest_templates.assert_not_called()
+
+    def register(self, faces_by_path):
+        face_recognition = face_recognition_utils.face_recognition
+        face_recognition.load_image_file.side_effect = lambda path: path
+        face_recognition.face_locations.side_effect = \
+            lambda path: [(0, 150, 150, 0)] * len(faces_by_path[path])
+        face_recognition.face_encodings.side_effect = \
+            lambda path, locations: faces_by_path[path]
+        return self.system.register_face(list(faces_by_path), 1)
+
+    def test_register_reports_added_and_skipped_photos(self):
+        student = self.add_student(1, [0.0], quality=1.0)
+
+        success, message = self.register({
+            'new.jpg': [encoding(3.0)],
+            'same.jpg': [encoding(0.1)],
+            'empty.jpg': [],
+            'group.jpg': [encoding(7.0), encoding(8.0)],
+        })
+
+        self.assertTrue(success)
+        self.assertIn('(1 template(s) added)', message)
+        self.assertIn('same.jpg: Too similar', message)
+        self.assertIn('empty.jpg: No face found', message)
+        self.assertIn('group.jpg: Multiple faces found', message)
+        self.assertEqual(student.photo_path, 'new.jpg')
+        self.db.session.commit.assert_called_once()
+
+    def test_register_reports_photos_evicted_within_batch(self):
+        student = self.add_student(1, [])
+
+        count = MAX_TEMPLATES_PER_STUDENT + 2
+        success, message = self.register(
+            {f'{index}.jpg': [encoding(float(index))] for index in range(count)}
+        )
+
+        self.assertTrue(success)
+        self.assertIn(f'({MAX_TEMPLATES_PER_STUDENT} template(s) added)', message)
+        self.assertIn('0.jpg: Replaced by a later photo', message)
+        self.assertIn('1.jpg: Replaced by a later photo', message)
+        self.assertEqual(student.photo_path, f'{count - 1}.jpg')
+
+    def test_register_fails_when_every_photo_is_duplicate(self):
+        self.add_student(1, [0.0], quality=1.0)
+
+        success, message = self.register({'same.jpg': [encoding(0.1)]})
+
+        self.assertFalse(success)
+        self.assertIn('same.jpg: Too similar', message)
+        self.db.session.commit.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,67 +4,270 @@ import numpy as np
 import os
 from PIL import Image
 import json
+import threading
+import time
 from database.models import Student, db
 
+# Gallery limits for the per-student face templates
+MAX_TEMPLATES_PER_STUDENT = 5
+DUPLICATE_TEMPLATE_DISTANCE = 0.2  # Templates closer than this are treated as duplicates
+REFERENCE_FACE_SIZE = 150  # Face height in pixels at which a template reaches full quality
+HARVEST_INTERVAL = 300  # Seconds between harvest attempts for the same student
+
+# A capture matched with confidence above this is always a near-duplicate of an
+# existing template, so a higher harvest threshold could never add a new template
+MAX_HARVEST_THRESHOLD = 1 - DUPLICATE_TEMPLATE_DISTANCE
+
+# Results of adding a template to a student's gallery
+TEMPLATE_ADDED = 'added'
+TEMPLATE_REPLACED = 'replaced'
+TEMPLATE_DUPLICATE = 'duplicate'
+TEMPLATE_REJECTED = 'rejected'
+
+def face_quality(face_location):
+    """Estimate template quality from the pixel height of the detected face"""
+    top, right, bottom, left = face_location
+    return min(1.0, (bottom - top) / REFERENCE_FACE_SIZE)
+
+EMPTY_KNOWN_FACES = (np.empty((0, 128)), np.empty(0, dtype=int), (), ())
+
 class FaceRecognitionSystem:
-    def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_student_ids = []
+    def __init__(self, harvest_threshold=None):
+        # Live captures matched with at least this confidence are added as templates
+        # (None disables harvesting). Captures matched closer than
+        # DUPLICATE_TEMPLATE_DISTANCE can only replace a near-duplicate template,
+        # so new variations come from confidences in [threshold, MAX_HARVEST_THRESHOLD]
+        if harvest_threshold is not None and harvest_threshold >= MAX_HARVEST_THRESHOLD:
+            raise ValueError(
+                f"harvest_threshold must be below {MAX_HARVEST_THRESHOLD:.2f}, "
+                "higher confidences only match near-duplicate templates"
+            )
+        self.harvest_threshold = harvest_threshold
+        self.last_harvest = {}  # student id -> time of the last harvest attempt
+        # Serializes gallery writes; reentrant because harvesting and registration
+        # refresh the known faces while holding it
+        self.lock = threading.RLock()
+        # (encodings, template offsets, student ids, names), always replaced as a
+        # whole so readers never see encodings and offsets out of step
+        self.known_faces = EMPTY_KNOWN_FACES
         self.load_known_faces()
     
     def load_known_faces(self):
-        """Load all registered student faces from database"""
+        """Load all registered student face templates from database"""
         students = Student.query.filter(Student.face_encoding.isnot(None)).all()
         
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_student_ids = []
+        encodings = []
+        offsets = []
+        student_ids = []
+        names = []
         
         for student in students:
-            encoding = student.get_face_encoding()
-            if encoding is not None:
-                self.known_face_encodings.append(encoding)
-                self.known_face_names.append(student.name)
-                self.known_student_ids.append(student.id)
+            student_encodings = student.get_face_encodings()
+            if student_encodings:
+                # Templates of one student are kept contiguous so distances
+                # can be reduced per student in a single operation
+                offsets.append(len(encodings))
+                encodings.extend(student_encodings)
+                student_ids.append(student.id)
+                names.append(student.name)
+        
+        if not encodings:
+            known_faces = EMPTY_KNOWN_FACES
+        else:
+            known_faces = (np.array(encodings), np.array(offsets, dtype=int),
+                           tuple(student_ids), tuple(names))
+        
+        with self.lock:
+            self.known_faces = known_faces
     
-    def register_face(self, image_path, student_id):
-        """Register a new face for a student"""
-        try:
-            # Load image
-            image = face_recognition.load_image_file(image_path)
+    def update_known_faces(self, student):
+        """Replace one student's templates in memory without reloading the database"""
+        with self.lock:
+            known_encodings, offsets, student_ids, names = self.known_faces
+            student_ids = list(student_ids)
+            names = list(names)
+            groups = np.split(known_encodings, offsets[1:]) if student_ids else []
             
-            # Find face encodings
-            face_encodings = face_recognition.face_encodings(image)
+            encodings = student.get_face_encodings()
+            if student.id in student_ids:
+                index = student_ids.index(student.id)
+                if encodings:
+                    groups[index] = np.array(encodings)
+                    names[index] = student.name
+                else:
+                    del groups[index]
+                    del names[index]
+                    del student_ids[index]
+            elif encodings:
+                groups.append(np.array(encodings))
+                names.append(student.name)
+                student_ids.append(student.id)
             
-            if len(face_encodings) == 0:
-                return False, "No face found in the image"
+            if not groups:
+                self.known_faces = EMPTY_KNOWN_FACES
+                return
             
-            if len(face_encodings) > 1:
-                return False, "Multiple faces found. Please use an image with only one face"
+            sizes = [len(group) for group in groups]
+            self.known_faces = (
+                np.concatenate(groups),
+                np.cumsum([0] + sizes[:-1]).astype(int),
+                tuple(student_ids),
+                tuple(names),
+            )
+    
+    def add_face_template(self, student, encoding, quality, upload=False):
+        """Add an encoding to a student's gallery, deduplicating and capping it
+        
+        Uploaded photos always get a place in a full gallery, evicting the
+        lowest quality template (the oldest on ties). Live captures only evict
+        a template of strictly lower quality.
+        """
+        templates = student.get_face_templates()
+        
+        if templates:
+            distances = face_recognition.face_distance(
+                [template[0] for template in templates], encoding
+            )
+            nearest_index = int(np.argmin(distances))
+            if distances[nearest_index] < DUPLICATE_TEMPLATE_DISTANCE:
+                # Near-duplicate: keep whichever of the two is better
+                if quality <= templates[nearest_index][1]:
+                    return TEMPLATE_DUPLICATE
+                templates[nearest_index] = (encoding, quality)
+                student.set_face_templates(templates)
+                return TEMPLATE_REPLACED
+        
+        if len(templates) >= MAX_TEMPLATES_PER_STUDENT:
+            # min() returns the first, i.e. oldest, of equally bad templates
+            worst_index = min(range(len(templates)), key=lambda i: templates[i][1])
+            if not upload and quality <= templates[worst_index][1]:
+                return TEMPLATE_REJECTED
+            del templates[worst_index]
+        
+        templates.append((encoding, quality))
+        student.set_face_templates(templates)
+        return TEMPLATE_ADDED
+    
+    def register_face(self, image_paths, student_id):
+        """Register one or more face images for a student"""
+        if isinstance(image_paths, str):
+            image_paths = [image_paths]
+        
+        try:
+            uploads = []
+            errors = []
             
-            # Get the face encoding
-            face_encoding = face_encodings[0]
+            for image_path in image_paths:
+                # Load image
+                image = face_recognition.load_image_file(image_path)
+                
+                # Find face locations and encodings
+                face_locations = face_recognition.face_locations(image)
+                
+                if len(face_locations) == 0:
+                    errors.append(f"{os.path.basename(image_path)}: No face found in the image")
+                    continue
+                
+                if len(face_locations) > 1:
+                    errors.append(f"{os.path.basename(image_path)}: Multiple faces found. "
+                                  "Please use an image with only one face")
+                    continue
+                
+                face_encoding = face_recognition.face_encodings(image, face_locations)[0]
+                uploads.append((image_path, face_encoding, face_quality(face_locations[0])))
             
-            # Save to database
-            student = Student.query.get(student_id)
-            if student:
-                student.set_face_encoding(face_encoding)
-                student.photo_path = image_path
-                db.session.commit()
+            with self.lock:
+                student = Student.query.get(student_id)
+                if not student:
+                    return False, "Student not found"
                 
-                # Reload known faces
-                self.load_known_faces()
+                stored = []
+                for image_path, face_encoding, quality in uploads:
+                    result = self.add_face_template(student, face_encoding, quality, upload=True)
+                    if result == TEMPLATE_DUPLICATE:
+                        errors.append(f"{os.path.basename(image_path)}: "
+                                      "Too similar to an already registered photo")
+                    else:
+                        stored.append((image_path, face_encoding))
                 
-                return True, "Face registered successfully"
-            else:
-                return False, "Student not found"
+                # A full gallery may have evicted photos stored earlier in this batch
+                kept_encodings = student.get_face_encodings()
+                kept = []
+                for image_path, face_encoding in stored:
+                    if any(np.array_equal(face_encoding, kept_encoding) for kept_encoding in kept_encodings):
+                        kept.append(image_path)
+                    else:
+                        errors.append(f"{os.path.basename(image_path)}: Replaced by a later photo, "
+                                      f"at most {MAX_TEMPLATES_PER_STUDENT} are kept")
+                
+                if not kept:
+                    db.session.rollback()
+                    return False, "; ".join(errors)
+                
+                student.photo_path = kept[-1]
+                db.session.commit()
+                
+                # Refresh this student's templates in memory
+                self.update_known_faces(student)
+            
+            message = f"Face registered successfully ({len(kept)} template(s) added)"
+            if errors:
+                message += ". Skipped: " + "; ".join(errors)
+            return True, message
                 
         except Exception as e:
             return False, f"Error registering face: {str(e)}"
     
-    def recognize_faces_in_frame(self, frame, tolerance=0.6):
-        """Recognize faces in a video frame"""
+    def harvest_templates(self, candidates):
+        """Store high-confidence live captures as extra templates
+        
+        Each student is considered at most once per HARVEST_INTERVAL so the
+        video loop does not hit the database on every frame.
+        """
+        with self.lock:
+            now = time.time()
+            updated_students = []
+            
+            for student_id, encoding, quality in candidates:
+                if now - self.last_harvest.get(student_id, 0) < HARVEST_INTERVAL:
+                    continue
+                self.last_harvest[student_id] = now
+                
+                student = Student.query.get(student_id)
+                if student and self.add_face_template(student, encoding, quality) in (TEMPLATE_ADDED, TEMPLATE_REPLACED):
+                    updated_students.append(student)
+            
+            if updated_students:
+                db.session.commit()
+                for student in updated_students:
+                    self.update_known_faces(student)
+    
+    def match_face_encodings(self, face_encodings, known_faces=None):
+        """Return the best matching student index and distance for each face
+        
+        Distances from every face to every known template are computed at once
+        and reduced to the closest template of each student. Indices refer to
+        the student ids of the same known_faces snapshot.
+        """
+        if known_faces is None:
+            known_faces = self.known_faces
+        known_encodings, offsets, _, _ = known_faces
+        
+        template_distances = np.linalg.norm(
+            known_encodings[np.newaxis, :, :] - np.array(face_encodings)[:, np.newaxis, :],
+            axis=2
+        )
+        student_distances = np.minimum.reduceat(template_distances, offsets, axis=1)
+        best_match_indices = np.argmin(student_distances, axis=1)
+        best_distances = student_distances[np.arange(len(face_encodings)), best_match_indices]
+        return best_match_indices, best_distances
+    
+    def recognize_faces_in_frame(self, frame, tolerance=0.6, harvest=False):
+        """Recognize faces in a video frame
+        
+        With harvest=True, confident matches may be stored as new templates
+        (only when a harvest_threshold is configured).
+        """
         # Resize frame for faster processing
         small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
         rgb_small_frame = small_frame[:, :, ::-1]
@@ -75,36 +278,47 @@ class FaceRecognitionSystem:
         
         recognized_students = []
         
-        for face_encoding, face_location in zip(face_encodings, face_locations):
-            # Compare with known faces
-            matches = face_recognition.compare_faces(
-                self.known_face_encodings, face_encoding, tolerance=tolerance
-            )
-            face_distances = face_recognition.face_distance(
-                self.known_face_encodings, face_encoding
-            )
+        # Read the known faces once so the whole frame uses one consistent snapshot
+        known_faces = self.known_faces
+        _, _, known_student_ids, known_face_names = known_faces
+        
+        if len(face_encodings) == 0 or len(known_student_ids) == 0:
+            return recognized_students
+        
+        best_match_indices, best_distances = self.match_face_encodings(face_encodings, known_faces)
+        
+        harvest = harvest and self.harvest_threshold is not None
+        harvest_candidates = []
+        
+        for face_index, (face_encoding, face_location) in enumerate(zip(face_encodings, face_locations)):
+            best_match_index = best_match_indices[face_index]
+            distance = best_distances[face_index]
             
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                
-                if matches[best_match_index]:
-                    student_id = self.known_student_ids[best_match_index]
-                    name = self.known_face_names[best_match_index]
-                    confidence = 1 - face_distances[best_match_index]
-                    
-                    # Scale back up face location
-                    top, right, bottom, left = face_location
-                    top *= 4
-                    right *= 4
-                    bottom *= 4
-                    left *= 4
-                    
-                    recognized_students.append({
-                        'student_id': student_id,
-                        'name': name,
-                        'confidence': confidence,
-                        'location': (top, right, bottom, left)
-                    })
+            if distance <= tolerance:
+                student_id = known_student_ids[best_match_index]
+                name = known_face_names[best_match_index]
+                confidence = 1 - distance
+                
+                if harvest and confidence >= self.harvest_threshold:
+                    # Quality reflects the resolution the encoding was computed from
+                    harvest_candidates.append((student_id, face_encoding, face_quality(face_location)))
+                
+                # Scale back up face location
+                top, right, bottom, left = face_location
+                top *= 4
+                right *= 4
+                bottom *= 4
+                left *= 4
+                
+                recognized_students.append({
+                    'student_id': student_id,
+                    'name': name,
+                    'confidence': confidence,
+                    'location': (top, right, bottom, left)
+                })
+        
+        if harvest_candidates:
+            self.harvest_templates(harvest_candidates)
         
         return recognized_students
     
@@ -125,8 +339,8 @@ class FaceRecognitionSystem:
         return frame
 
 class AttendanceTracker:
-    def __init__(self):
-        self.face_recognition_system = FaceRecognitionSystem()
+    def __init__(self, harvest_threshold=None):
+        self.face_recognition_system = FaceRecognitionSystem(harvest_threshold=harvest_threshold)
         self.attendance_buffer = {}  # Buffer to avoid duplicate entries
         self.buffer_timeout = 10  # seconds
     